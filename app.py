@@ -271,13 +271,15 @@
 # ✅ Handles Render limitations automatically
 # ✅ Retries on network hiccups
 # ✅ Caches data for 30 min (no repeat fetch)
-# ✅ Prevents memory overload (400 MB limit)
+# ✅ Adaptive memory governor (degrades instead of crashing)
 # ✅ Spinner feedback during heavy loads
 # ✅ Fast Mode default = instant load
 
+import gc
 import os
+import ctypes
 import time
-import resource
+import threading
 import streamlit as st
 import pandas as pd
 import numpy as np
@@ -287,17 +289,11 @@ import fastf1
 from fastf1 import plotting
 
 # ---------------------------------------------
-# BASIC CONFIG & MEMORY LIMIT
+# BASIC CONFIG
 # ---------------------------------------------
 st.set_page_config(page_title="FastLaneF1 Analytics", layout="wide")
 st.title("🏎️ FastLaneF1 – Live F1 Telemetry & Race Analytics")
 
-# Prevent Render from killing process due to over-memory usage
-try:
-    resource.setrlimit(resource.RLIMIT_AS, (400 * 1024 * 1024, -1))
-except Exception:
-    pass  # not supported on all systems
-
 # Create cache directory if missing
 os.makedirs("cache", exist_ok=True)
 fastf1.Cache.enable_cache("cache")
@@ -305,13 +301,14 @@ fastf1.Cache.enable_cache("cache")
 # ---------------------------------------------
 # CACHED DATA LOADERS
 # ---------------------------------------------
-@st.cache_data(show_spinner=False, ttl=1800)
-def load_f1_session(year, gp, session_type):
-    """Fetch and cache a full F1 session with retry logic."""
+CACHE_TTL = 1800
+
+def load_with_retry(year, gp, session_type, **load_kwargs):
+    """Fetch an F1 session, retrying up to three times on failure."""
     session = fastf1.get_session(year, gp, session_type)
     for attempt in range(3):
         try:
-            session.load()
+            session.load(**load_kwargs)
             return session
         except Exception as e:
             if attempt < 2:
@@ -320,13 +317,210 @@ def load_f1_session(year, gp, session_type):
             else:
                 raise e
 
-@st.cache_data(show_spinner=False, ttl=1800)
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL)
+def load_f1_session(year, gp, session_type):
+    """Fetch and cache a full F1 session with retry logic."""
+    record_cache_miss("full")  # body only runs on a cache miss
+    return load_with_retry(year, gp, session_type)
+
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL, max_entries=1)
+def load_f1_session_lean(year, gp, session_type):
+    """Fetch and cache one full session at a time, without weather/messages."""
+    record_cache_miss("lean")
+    return load_with_retry(year, gp, session_type, laps=True, telemetry=True, weather=False, messages=False)
+
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL)
 def load_f1_summary(year, gp, session_type):
     """Fetch and cache a lightweight session summary (laps only)."""
+    record_cache_miss("fast")
     session = fastf1.get_session(year, gp, session_type)
     session.load(laps=True, telemetry=False)
     return session
 
+# ---------------------------------------------
+# MEMORY GOVERNOR
+# ---------------------------------------------
+# Render's free tier gives us 512 MB; stay just under it instead of capping
+# the address space (RLIMIT_AS made pandas/FastF1 fail mid-allocation).
+# Nothing below can catch an OOM kill, so the budget check is the only guard.
+MEMORY_LIMIT_MB = int(os.environ.get("FASTLANE_MEMORY_MB", 512))
+MEMORY_BUDGET_MB = MEMORY_LIMIT_MB * 0.9
+
+# Rough peak RSS growth (MB) of an uncached load, including the pickled copy
+# st.cache_data keeps; blended with real measurements as loads happen
+SESSION_FOOTPRINT_MB = {
+    "full": {"Race": 260, "Qualifying": 140, "Sprint": 120},
+    "lean": {"Race": 150, "Qualifying": 80, "Sprint": 70},
+    "fast": {"Race": 30, "Qualifying": 15, "Sprint": 15},
+}
+CACHE_HIT_FRACTION = 0.5  # a hit unpickles one copy, a miss also keeps the pickle
+FOOTPRINT_DECAY = 0.5     # weight of the newest measurement
+TELEMETRY_MB_PER_DRIVER = 2
+
+# Without a resettable high-water mark we only see the steady-state growth,
+# so pad it to cover the pandas temporaries inside session.load()
+UNTRACKED_PEAK_MARGIN = 1.5
+
+# Only these channels are plotted, so the combined frame keeps just these
+TELEMETRY_CHANNELS = ["Time", "Distance", "Speed"]
+
+def current_rss_mb():
+    """Current resident set size in MB, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def trim_heap():
+    """Collect garbage and hand freed heap pages back to the OS (glibc only).
+
+    Otherwise pages freed by the previous rerun stay resident and RSS
+    overstates how much memory is actually in use.
+    """
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+def reset_peak_rss():
+    """Reset the kernel's RSS high-water mark; returns False if unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """Peak resident set size (VmHWM) in MB since the last reset."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    raise OSError("VmHWM not reported")
+
+@st.cache_resource
+def governor_lock():
+    """Serializes planning and measured (uncached) loads across browser sessions."""
+    return threading.Lock()
+
+@st.cache_resource
+def governor_state():
+    """Process-wide loader bookkeeping, shared by every browser session."""
+    return {
+        "thread": threading.local(),  # .missed = mode of this thread's last miss
+        "cached": {},                 # (mode, year, gp, session) -> time it was cached
+        "footprints": {},             # (mode, year, gp, session) -> peak RSS growth in MB
+    }
+
+def record_cache_miss(mode):
+    governor_state()["thread"].missed = mode
+
+def drop_expired():
+    cached = governor_state()["cached"]
+    now = time.time()
+    for entry, cached_at in list(cached.items()):
+        if now - cached_at >= CACHE_TTL:
+            del cached[entry]
+
+def is_cached(mode, key):
+    cached_at = governor_state()["cached"].get((mode, *key))
+    return cached_at is not None and time.time() - cached_at < CACHE_TTL
+
+def estimate_footprint_mb(mode, key):
+    """Estimate the peak RSS a load will add, cheaper if it is a cache hit."""
+    miss = governor_state()["footprints"].get((mode, *key), SESSION_FOOTPRINT_MB[mode][key[2]])
+    return miss * CACHE_HIT_FRACTION if is_cached(mode, key) else miss
+
+def fits_in_budget(estimate_mb):
+    rss = current_rss_mb()
+    return rss is None or rss + estimate_mb <= MEMORY_BUDGET_MB
+
+def evict_caches():
+    """Drop the cached full sessions; returns True only if a live one was freed."""
+    cached = governor_state()["cached"]
+    full = [entry for entry in cached if entry[0] == "full"]
+    if not full:
+        return False
+    live = any(is_cached("full", entry[1:]) for entry in full)
+    load_f1_session.clear()
+    for entry in full:
+        del cached[entry]
+    trim_heap()
+    return live
+
+def choose_telemetry_mode(key):
+    for mode in ("full", "lean"):
+        if fits_in_budget(estimate_footprint_mb(mode, key)):
+            return mode
+    return None
+
+def plan_load(year, gp, session_type, want_full, decisions):
+    """Pick the heaviest load mode that fits, or None if even the summary won't.
+
+    Caches are evicted at most once per plan, and never when the requested
+    full session is cached, since that hit is the cheapest telemetry path.
+    """
+    key = (year, gp, session_type)
+    drop_expired()
+    trim_heap()
+    evicted = False
+    if want_full:
+        mode = choose_telemetry_mode(key)
+        if mode:
+            return mode
+        if not is_cached("full", key) and evict_caches():
+            evicted = True
+            decisions.append("Evicted cached full sessions to make room for telemetry.")
+            mode = choose_telemetry_mode(key)
+            if mode:
+                return mode
+        needed = min(estimate_footprint_mb(mode, key) for mode in ("full", "lean"))
+        decisions.append(
+            f"Telemetry needs ~{needed:.0f} MB but only "
+            f"{MEMORY_BUDGET_MB - current_rss_mb():.0f} MB is free — falling back to Fast Mode."
+        )
+    if fits_in_budget(estimate_footprint_mb("fast", key)):
+        return "fast"
+    if not evicted and evict_caches():
+        decisions.append("Evicted cached full sessions to make room for the summary.")
+        if fits_in_budget(estimate_footprint_mb("fast", key)):
+            return "fast"
+    return None
+
+def governed_load(year, gp, session_type, mode, measure):
+    """Load a session, tracking cache state and (if measure) its peak RSS growth.
+
+    Only measure with governor_lock() held: the high-water mark is process-wide.
+    """
+    loaders = {"full": load_f1_session, "lean": load_f1_session_lean, "fast": load_f1_summary}
+    state = governor_state()
+    key = (year, gp, session_type)
+    before = current_rss_mb() if measure else None
+    peak_tracked = before is not None and reset_peak_rss()
+    state["thread"].missed = None
+    session = loaders[mode](year, gp, session_type)
+    if state["thread"].missed != mode:
+        return session
+    if mode == "lean":
+        # max_entries=1 means any other lean session was just evicted
+        for entry in [e for e in state["cached"] if e[0] == "lean"]:
+            del state["cached"][entry]
+    state["cached"][(mode, *key)] = time.time()
+    if before is None:
+        return session
+    if peak_tracked:
+        growth = peak_rss_mb() - before
+    else:
+        growth = (current_rss_mb() - before) * UNTRACKED_PEAK_MARGIN
+    footprint_key = (mode, *key)
+    previous = state["footprints"].get(footprint_key, SESSION_FOOTPRINT_MB[mode][session_type])
+    state["footprints"][footprint_key] = (1 - FOOTPRINT_DECAY) * previous + FOOTPRINT_DECAY * growth
+    return session
+
 # ---------------------------------------------
 # SIDEBAR CONTROLS
 # ---------------------------------------------
@@ -355,18 +549,48 @@ st.sidebar.write("---")
 # ---------------------------------------------
 st.write(f"### Loading {session_type} data for {gp} {year}... ⏳")
 
+memory_decisions = []
+session_key = (year, gp, session_type)
+
+# Fast Mode never takes the lock; telemetry plans wait for other measured loads
+lock = governor_lock()
+locked = False
+if not light_mode:
+    if not lock.acquire(blocking=False):
+        with st.spinner("⏳ Waiting for another session's load to finish..."):
+            lock.acquire()
+    locked = True
+
 try:
-    if light_mode:
-        with st.spinner(f"⚡ Loading {gp} {session_type} summary (no telemetry)..."):
-            session = load_f1_summary(year, gp, session_type)
-        st.success(f"✅ Loaded summary for {gp} {session_type} ({year})")
-    else:
-        with st.spinner(f"🔄 Fetching full telemetry for {gp} {session_type} ({year})... this may take a minute ⏱️"):
-            session = load_f1_session(year, gp, session_type)
-        st.success(f"✅ Loaded full data for {gp} {session_type} ({year})")
-except Exception as e:
-    st.error(f"❌ Could not load session data: {e}")
-    st.stop()
+    load_mode = plan_load(year, gp, session_type, not light_mode, memory_decisions)
+    if load_mode is None:
+        st.error("❌ Not enough memory to load this session right now — please try again shortly.")
+        st.stop()
+
+    # Only uncached telemetry loads keep the lock, so their peak is measured alone
+    measure = load_mode != "fast" and not is_cached(load_mode, session_key)
+    if locked and not measure:
+        lock.release()
+        locked = False
+
+    try:
+        if load_mode == "fast":
+            with st.spinner(f"⚡ Loading {gp} {session_type} summary (no telemetry)..."):
+                session = governed_load(year, gp, session_type, "fast", measure)
+            st.success(f"✅ Loaded summary for {gp} {session_type} ({year})")
+        else:
+            with st.spinner(f"🔄 Fetching full telemetry for {gp} {session_type} ({year})... this may take a minute ⏱️"):
+                session = governed_load(year, gp, session_type, load_mode, measure)
+            st.success(f"✅ Loaded full data for {gp} {session_type} ({year})")
+    except Exception as e:
+        st.error(f"❌ Could not load session data: {e}")
+        st.stop()
+finally:
+    if locked:
+        lock.release()
+
+if load_mode == "lean":
+    memory_decisions.append("Loaded telemetry without weather or race-control messages.")
 
 # ---------------------------------------------
 # PLOT 1 — LAP TIME COMPARISON
@@ -386,13 +610,17 @@ st.plotly_chart(fig1, width="stretch")
 # ---------------------------------------------
 if light_mode:
     st.info("🕹️ Fast Mode active — showing only lap time analysis (telemetry skipped).")
+elif load_mode == "fast":
+    st.info("🧠 Not enough memory for telemetry — showing only lap time analysis.")
 else:
     telemetry = pd.DataFrame()
     for drv in drivers:
+        if not fits_in_budget(TELEMETRY_MB_PER_DRIVER):
+            memory_decisions.append(f"Memory budget reached — skipped telemetry from {drv} onwards.")
+            break
         try:
             fastest = laps.pick_driver(drv).pick_fastest()
-            drv_tel = fastest.get_car_data().add_distance()
-            drv_tel["Driver"] = drv
+            drv_tel = fastest.get_car_data().add_distance()[TELEMETRY_CHANNELS].assign(Driver=drv)
             telemetry = pd.concat([telemetry, drv_tel])
         except Exception:
             st.warning(f"⚠️ Some telemetry missing for {drv}")
@@ -450,6 +678,20 @@ else:
     else:
         st.info("ℹ️ Telemetry data not available for this session.")
 
+# ---------------------------------------------
+# MEMORY REPORT
+# ---------------------------------------------
+for decision in memory_decisions:
+    st.warning(f"🧠 {decision}")
+
+with st.sidebar.expander("🧠 Memory", expanded=bool(memory_decisions)):
+    rss = current_rss_mb()
+    rss_text = "unknown" if rss is None else f"{rss:.0f} MB"
+    st.write(f"RSS: {rss_text} / budget {MEMORY_BUDGET_MB:.0f} MB")
+    st.write(f"Load mode: {load_mode}")
+    for decision in memory_decisions:
+        st.write(f"- {decision}")
+
 # ---------------------------------------------
 # FOOTER
 # ---------------------------------------------